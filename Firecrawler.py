@@ -396,3 +396,42 @@ class FireCrawlWebReader(BasePydanticReader):
             )
 
         return documents
+
+    def load_from_frontier(
+        self,
+        frontier,
+        batch_size: int = 10,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> List[Document]:
+        """Drain a `URLFrontier` and load its URLs in priority order.
+
+        Args:
+            frontier (URLFrontier): Frontier holding canonical, deduplicated URLs.
+            batch_size (int): Number of URLs popped from the frontier at a time.
+            progress_callback (Optional[Callable[[int, int], None]]): Called
+                with (urls done, urls total) after every batch.
+
+        Returns:
+            List[Document]: List of documents.
+        """
+        documents = []
+        total = len(frontier)
+        done = 0
+
+        for batch in frontier.batches(batch_size):
+            if self.mode in ("scrape", "extract"):
+                documents.extend(self.load_data(urls=batch))
+            elif self.mode == "crawl":
+                # Crawls are started one root at a time, highest priority first
+                for url in batch:
+                    documents.extend(self.load_data(url=url))
+            else:
+                raise ValueError(
+                    "Frontier loading is only supported in 'scrape', 'crawl' and 'extract' modes."
+                )
+
+            done += len(batch)
+            if progress_callback:
+                progress_callback(done, total)
+
+        return documents
@@ -0,0 +1,95 @@
+"""Cleaning and chunking of scraped documents before indexing."""
+import re
+
+from llama_index.core import Document
+
+def split_text_into_chunks(text, max_chars=4000):
+    """Split text into chunks of approximately max_chars while keeping sentences intact."""
+    # Split into sentences
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    
+    for sentence in sentences:
+        sentence_length = len(sentence)
+        
+        if current_length + sentence_length > max_chars and current_chunk:
+            # Join current chunk and add to chunks
+            chunks.append(' '.join(current_chunk))
+            current_chunk = [sentence]
+            current_length = sentence_length
+        else:
+            current_chunk.append(sentence)
+            current_length += sentence_length
+    
+    # Add the last chunk if it exists
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    
+    return chunks
+
+def clean_scraped_text(text):
+    """Remove common footer content and privacy policy text."""
+    # First, try to find and remove the entire privacy settings block
+    
+    # Pattern to match the entire privacy settings section
+    privacy_pattern = r"Privacy settings\s*Decide which cookies.*?(?:Change settings Read more Accept|Save)"
+    cleaned_text = re.sub(privacy_pattern, "", text, flags=re.DOTALL)
+    
+    # Additional patterns to clean up
+    patterns = [
+        r"FunctionalityAnalyticsAdvertising",
+        r"(?:Essential|Functionality|Analytics|Advertising):.*?(?:\n|$)",
+        r"This page will(?: not)? be:.*?(?=This page|Save|\n\n|$)",
+        r"a contact forms, newsletter and other forms across all pages",
+        r"and interaction taken",
+        r"and region based on your IP number",
+        r"on each page",
+        r"of the statistics functions",
+        r"and advertising to your interests.*?targeting cookies\.\)",
+        r"we sometimes place small data files called cookies.*?websites do this too\.",
+        r"Change settings Read more Accept",
+        r"Save",
+        # Remove any remaining cookie-related text
+        r"Cookies To make this site work properly.*?(?:\n|$)",
+        # Remove multiple consecutive newlines and whitespace
+        r"\n\s*\n\s*\n+",
+    ]
+    
+    # Apply all patterns
+    for pattern in patterns:
+        cleaned_text = re.sub(pattern, "", cleaned_text, flags=re.DOTALL | re.MULTILINE)
+    
+    # Final cleanup of whitespace and newlines
+    cleaned_text = re.sub(r'\n\s*\n', '\n\n', cleaned_text)
+    cleaned_text = re.sub(r'^\s+|\s+$', '', cleaned_text, flags=re.MULTILINE)
+    
+    return cleaned_text.strip()
+
+def process_document(doc):
+    """Process a document by cleaning and splitting if necessary."""
+    cleaned_text = clean_scraped_text(doc.text)
+    text_chunks = split_text_into_chunks(cleaned_text)
+    
+    processed_docs = []
+    total_chunks = len(text_chunks)
+    
+    for i, chunk in enumerate(text_chunks, 1):
+        # Create new metadata with chunk information
+        chunk_metadata = doc.metadata.copy() if doc.metadata else {}
+        chunk_metadata.update({
+            'chunk_number': i,
+            'total_chunks': total_chunks,
+            'is_chunked': total_chunks > 1
+        })
+        
+        # Create new document with chunk
+        chunk_doc = Document(
+            text=chunk,
+            metadata=chunk_metadata,
+            id_=f"{doc.id_}_chunk_{i}" if doc.id_ else None
+        )
+        processed_docs.append(chunk_doc)
+    
+    return processed_docs
@@ -0,0 +1,571 @@
+"""Background ingestion service.
+
+Scrape and index jobs are stored in a SQLite job queue shared with the
+Streamlit app. The app only submits jobs and polls their status; this
+service runs them on a bounded pool of worker threads.
+
+Run it next to the app:
+
+    python ingestion_service.py --workers 4
+
+Several services may share the same database. Each renews a lease on the
+jobs it runs; jobs of a service that stops renewing are requeued.
+
+The Firecrawl and Voyage API keys are read from the environment
+(FIRECRAWL_API_KEY, VOYAGE_API_KEY) or from .streamlit/secrets.toml. Each
+user's own Pinecone key travels with their index job, encrypted (see
+`encrypt_secret`), and is deleted from the job when it ends.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import tomllib
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_DB_PATH = Path(__file__).with_name("ingestion_jobs.db")
+SECRETS_PATH = Path(__file__).with_name(".streamlit") / "secrets.toml"
+SECRET_KEY_PATH = Path(__file__).with_name("ingestion_secret.key")
+
+# Encrypted job secrets older than this can't be decrypted anymore, so a job
+# that waited too long fails instead of using a stale credential
+JOB_SECRET_TTL = 24 * 60 * 60
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A running job belongs to the service that claimed it for as long as that
+# service keeps renewing its lease; jobs with an expired lease are requeued
+HEARTBEAT_INTERVAL = 10.0
+LEASE_TIMEOUT = 60.0
+
+# Columns returned for a job; `result` is left out, it can be megabytes of
+# documents and is only read by `load_documents`
+JOB_COLUMNS = (
+    "id, owner, kind, status, payload, progress, message, error, created_at, updated_at, "
+    "heartbeat_at"
+)
+
+logger = logging.getLogger("ingestion_service")
+
+
+class LeaseLostError(Exception):
+    """The job's lease expired and the job may now be run by another worker."""
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+class JobQueue:
+    """Persistent job queue backed by SQLite.
+
+    Safe to use from several threads and processes; every call opens its own
+    connection. Running jobs are leased to a worker id; see `heartbeat` and
+    `requeue_expired`.
+
+    Args:
+    db_path: Path of the SQLite database file.
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_DB_PATH) -> None:
+        """Initialize with parameters."""
+        self.db_path = Path(db_path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    worker_id TEXT,
+                    heartbeat_at REAL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+            )
+        # Job payloads and scraped content are only for the service's user
+        os.chmod(self.db_path, 0o600)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Autocommit connection; claim_next opens its own transaction
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def submit(
+        self, owner: str, kind: str, payload: Dict, secrets: Optional[Dict[str, str]] = None
+    ) -> str:
+        """Add a job to the queue.
+
+        Args:
+            owner: Id of the user submitting the job, used for fair scheduling.
+            kind: "scrape" or "index".
+            payload: Job parameters, must be JSON serializable.
+            secrets: Credentials for the job. They are stored encrypted in the
+                payload under "secrets" and removed when the job ends.
+
+        Returns:
+            str: The job id.
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind '{kind}'.")
+
+        if secrets:
+            payload = dict(payload, secrets={name: encrypt_secret(value) for name, value in secrets.items()})
+
+        job_id = uuid.uuid4().hex
+        now = _now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, owner, kind, status, payload, message, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, kind, QUEUED, json.dumps(payload), "Waiting for a worker", now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return a job (without its result), or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, owner: str, limit: int = 20) -> List[Dict]:
+        """Return the most recent jobs of a user, newest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?",
+                (owner, limit),
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim_next(self, worker_id: str) -> Optional[Dict]:
+        """Atomically take the next queued job and lease it to `worker_id`.
+
+        Jobs of the user with the fewest running jobs go first, so one user
+        submitting many jobs can't starve the others. Ties go to the oldest job.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"""
+                    SELECT {JOB_COLUMNS} FROM jobs AS j
+                    WHERE j.status = ?
+                    ORDER BY (
+                        SELECT COUNT(*) FROM jobs AS r
+                        WHERE r.owner = j.owner AND r.status = ?
+                    ), j.created_at
+                    LIMIT 1
+                    """,
+                    (QUEUED, RUNNING),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = ?, message = ?, updated_at = ?, worker_id = ?, "
+                    "heartbeat_at = ? WHERE id = ?",
+                    (RUNNING, "Started", _now(), worker_id, time.time(), row["id"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        job = self._to_dict(row)
+        job["status"] = RUNNING
+        job["worker_id"] = worker_id
+        return job
+
+    # The updates below only apply while `worker_id` still holds the job's
+    # lease. They return False when it doesn't: the job was requeued and
+    # possibly claimed by another worker, whose outcome must not be overwritten.
+
+    def update_progress(self, job_id: str, worker_id: str, progress: float, message: str = "") -> bool:
+        """Record the progress (0 to 1) of a running job."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET progress = ?, message = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (progress, message, _now(), job_id, worker_id, RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def complete(
+        self, job_id: str, worker_id: str, result: Optional[List[Dict]], message: str = "Done"
+    ) -> bool:
+        """Mark a job as done, store its result and delete its secrets."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, message = ?, result = ?, updated_at = ?, "
+                "payload = json_remove(payload, '$.secrets') "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (
+                    DONE,
+                    message,
+                    json.dumps(result) if result is not None else None,
+                    _now(),
+                    job_id,
+                    worker_id,
+                    RUNNING,
+                ),
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """Mark a job as failed and delete its secrets."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, error = ?, updated_at = ?, "
+                "payload = json_remove(payload, '$.secrets') "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (FAILED, "Failed", error, _now(), job_id, worker_id, RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def heartbeat(self, worker_id: str) -> None:
+        """Renew the lease on all running jobs of `worker_id`."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND worker_id = ?",
+                (time.time(), RUNNING, worker_id),
+            )
+
+    def requeue_expired(self, lease_timeout: float = LEASE_TIMEOUT) -> int:
+        """Put running jobs whose lease was not renewed back in the queue.
+
+        These were left behind by a service that crashed or was killed; jobs
+        of services that are still alive keep their lease.
+
+        Returns:
+            int: Number of jobs requeued.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, progress = 0, message = ?, updated_at = ?, "
+                "worker_id = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (QUEUED, "Requeued after its worker stopped", _now(), RUNNING, time.time() - lease_timeout),
+            )
+        return cursor.rowcount
+
+    def load_documents(self, job_id: str) -> List:
+        """Return the documents produced by a finished scrape job."""
+        from llama_index.core import Document
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["result"] is None:
+            return []
+        return [Document.from_dict(doc) for doc in json.loads(row["result"])]
+
+
+def load_secrets() -> Dict:
+    """Read API keys from the environment, falling back to the Streamlit secrets file."""
+    secrets = {}
+    if SECRETS_PATH.exists():
+        with open(SECRETS_PATH, "rb") as f:
+            secrets = tomllib.load(f)
+
+    return {
+        "firecrawl_api_key": os.environ.get("FIRECRAWL_API_KEY", secrets.get("firecrawl_api_key")),
+        "voyage_api_key": os.environ.get("VOYAGE_API_KEY", secrets.get("voyage_api_key")),
+    }
+
+
+def _fernet():
+    """Return the cipher for job secrets, shared by the app and the service.
+
+    The key comes from INGESTION_SECRET_KEY or `ingestion_secret_key` in the
+    Streamlit secrets; without one, a key file readable only by its owner is
+    created next to the database on first use.
+    """
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        raise ImportError(
+            "`cryptography` package not found, please run `pip install cryptography`"
+        )
+
+    key = os.environ.get("INGESTION_SECRET_KEY")
+    if not key and SECRETS_PATH.exists():
+        with open(SECRETS_PATH, "rb") as f:
+            key = tomllib.load(f).get("ingestion_secret_key")
+    if not key:
+        try:
+            fd = os.open(SECRET_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            key = SECRET_KEY_PATH.read_text().strip()
+        else:
+            key = Fernet.generate_key().decode()
+            with os.fdopen(fd, "w") as f:
+                f.write(key)
+    return Fernet(key)
+
+
+def encrypt_secret(value: str) -> str:
+    """Encrypt a credential for storage in a job payload."""
+    return _fernet().encrypt(value.encode()).decode()
+
+
+def decrypt_secret(token: str) -> str:
+    """Decrypt a credential from a job payload.
+
+    Raises:
+        ValueError: If the token is invalid or older than `JOB_SECRET_TTL`.
+    """
+    from cryptography.fernet import InvalidToken
+
+    try:
+        return _fernet().decrypt(token.encode(), ttl=JOB_SECRET_TTL).decode()
+    except InvalidToken:
+        raise ValueError("The job's credentials expired or are invalid, please submit it again.")
+
+
+def run_scrape_job(queue: JobQueue, job: Dict, secrets: Dict) -> Tuple[List[Dict], str]:
+    """Scrape the job's URLs (and sitemap), then clean and chunk the documents.
+
+    Returns:
+        Tuple[List[Dict], str]: The serialized documents and a summary message.
+    """
+    from Firecrawler import FireCrawlWebReader
+    from url_frontier import MAX_SITEMAP_URLS, URLFrontier
+    from document_processing import process_document
+
+    payload = job["payload"]
+    reader = FireCrawlWebReader(api_key=secrets["firecrawl_api_key"], mode="scrape")
+
+    frontier = URLFrontier(max_per_domain=5, min_domain_interval=1.0)
+    frontier.add_many(payload.get("urls", []))
+    if payload.get("sitemap_url"):
+        frontier.seed_from_sitemap(
+            payload["sitemap_url"],
+            max_urls=payload.get("max_sitemap_urls", MAX_SITEMAP_URLS),
+        )
+
+    notes = []
+    if frontier.duplicates:
+        notes.append(f"skipped {frontier.duplicates} duplicate URL(s)")
+    if frontier.rejected:
+        notes.append("ignored invalid URL(s): " + ", ".join(frontier.rejected))
+    if frontier.failed_sitemaps:
+        notes.append("skipped sitemap(s): " + ", ".join(frontier.failed_sitemaps))
+    notes = "; ".join(notes)
+
+    def report(done: int, total: int) -> None:
+        # Scraping is the bulk of the work; processing takes the last 10%
+        message = f"Scraped {done}/{total} URL(s)"
+        message = f"{message}; {notes}" if notes else message
+        if not queue.update_progress(job["id"], job["worker_id"], 0.9 * done / total, message):
+            # Stop paying for scrapes another worker is now doing
+            raise LeaseLostError(job["id"])
+
+    documents = reader.load_from_frontier(frontier, batch_size=10, progress_callback=report)
+
+    # Process documents (clean and chunk if necessary)
+    processed_documents = []
+    for doc in documents:
+        processed_documents.extend(process_document(doc))
+
+    message = f"Scraped {len(documents)} page(s)"
+    if notes:
+        message += f"; {notes}"
+    return [doc.to_dict() for doc in processed_documents], message
+
+
+def run_index_job(queue: JobQueue, job: Dict, secrets: Dict) -> Tuple[None, str]:
+    """Store the documents of a finished scrape job in a Pinecone index.
+
+    Returns:
+        Tuple[None, str]: No result, and a summary message.
+    """
+    import pinecone as pi
+    from llama_index.core import StorageContext, VectorStoreIndex
+    from llama_index.vector_stores.pinecone import PineconeVectorStore
+    from llama_index.embeddings.voyageai import VoyageEmbedding
+
+    payload = job["payload"]
+    documents = queue.load_documents(payload["scrape_job_id"])
+    if not documents:
+        raise ValueError("The scrape job has no documents to index.")
+
+    if not queue.update_progress(job["id"], job["worker_id"], 0.1, f"Indexing {len(documents)} document(s)"):
+        raise LeaseLostError(job["id"])
+    pinecone_api_key = decrypt_secret(payload["secrets"]["pinecone_api_key"])
+
+    # Initialize Pinecone and embedding model
+    embed_model = VoyageEmbedding(
+        voyage_api_key=secrets["voyage_api_key"],
+        model_name="voyage-3-large",
+    )
+
+    pc = pi.Pinecone(api_key=pinecone_api_key)
+    pinecone_index = pc.Index(payload["index_name"])
+
+    vector_store = PineconeVectorStore(pinecone_index=pinecone_index, namespace='info')
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+
+    VectorStoreIndex.from_documents(
+        documents,
+        storage_context=storage_context,
+        embed_model=embed_model
+    )
+    return None, f"Indexed {len(documents)} document(s) in {payload['index_name']}"
+
+
+JOB_HANDLERS = {
+    "scrape": run_scrape_job,
+    "index": run_index_job,
+}
+
+
+class IngestionService:
+    """Runs queued jobs on a bounded pool of worker threads.
+
+    Args:
+    queue: The job queue to take jobs from.
+    num_workers: Number of jobs run at the same time.
+    poll_interval: Seconds an idle worker waits before checking the queue again.
+    """
+
+    def __init__(self, queue: JobQueue, num_workers: int = 4, poll_interval: float = 1.0) -> None:
+        """Initialize with parameters."""
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1.")
+        self.queue = queue
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.secrets = load_secrets()
+        self.worker_id = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._heartbeat_stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the workers and the lease heartbeat."""
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat, name="ingestion-heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _heartbeat(self) -> None:
+        # Also recovers jobs of services that died, including a previous run of this one
+        while True:
+            try:
+                self.queue.heartbeat(self.worker_id)
+                requeued = self.queue.requeue_expired()
+                if requeued:
+                    logger.info("Requeued %d job(s) with an expired lease", requeued)
+            except Exception:
+                logger.exception("Heartbeat error")
+            if self._heartbeat_stop.wait(HEARTBEAT_INTERVAL):
+                return
+
+    def stop(self) -> None:
+        """Stop taking new jobs and wait for the running ones to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        # Leases are renewed until the last job is done, so no other service
+        # requeues a job this one is still running
+        self._heartbeat_stop.set()
+        if self._heartbeat_thread:
+            self._heartbeat_thread.join()
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            # A worker must survive queue errors (e.g. a locked database),
+            # otherwise the pool silently shrinks
+            try:
+                job = self.queue.claim_next(self.worker_id)
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+                self.run_job(job)
+            except Exception:
+                logger.exception("Worker error")
+                self._stop.wait(self.poll_interval)
+
+    def run_job(self, job: Dict) -> None:
+        """Run one claimed job and record its outcome."""
+        logger.info("Running %s job %s for %s", job["kind"], job["id"], job["owner"])
+        try:
+            result, message = JOB_HANDLERS[job["kind"]](self.queue, job, self.secrets)
+        except LeaseLostError:
+            logger.warning("Lost the lease on job %s, abandoning it", job["id"])
+            return
+        except Exception as e:
+            logger.exception("Job %s failed", job["id"])
+            if not self.queue.fail(job["id"], self.worker_id, str(e)):
+                logger.warning("Lost the lease on job %s, dropping its failure", job["id"])
+            return
+
+        try:
+            stored = self.queue.complete(job["id"], self.worker_id, result, message)
+        except Exception as e:
+            logger.exception("Could not store the result of job %s", job["id"])
+            stored = self.queue.fail(job["id"], self.worker_id, f"Could not store the result: {e}")
+        if not stored:
+            logger.warning("Lost the lease on job %s, dropping its result", job["id"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the background ingestion workers.")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="Path of the job queue database.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent jobs.")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Idle polling interval in seconds.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(message)s")
+
+    service = IngestionService(JobQueue(args.db), num_workers=args.workers, poll_interval=args.poll_interval)
+    service.start()
+    logger.info("Ingestion service started with %d worker(s)", args.workers)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Stopping, waiting for running jobs to finish")
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,118 +1,41 @@
 import os
 import json
+import time
+import uuid
+import datetime
 from pathlib import Path
 #core
 import streamlit as st
-import pinecone as pi
 #llama
 from llama_index.core import Document
-from llama_index.vector_stores.pinecone import PineconeVectorStore
-from llama_index.core import StorageContext, VectorStoreIndex
 from llama_index.readers.web import UnstructuredURLLoader
-from llama_index.embeddings.voyageai import VoyageEmbedding
-from Firecrawler import FireCrawlWebReader
+from ingestion_service import JobQueue, QUEUED, RUNNING, DONE, FAILED, LEASE_TIMEOUT
+from url_frontier import MAX_SITEMAP_URLS, canonicalize_url
 
 # Set page config
 st.set_page_config(page_title="Universal Content Scraper", layout="wide")
 st.title("Universal Content Scraper")
 
-def split_text_into_chunks(text, max_chars=4000):
-    """Split text into chunks of approximately max_chars while keeping sentences intact."""
-    import re
-    
-    # Split into sentences
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for sentence in sentences:
-        sentence_length = len(sentence)
-        
-        if current_length + sentence_length > max_chars and current_chunk:
-            # Join current chunk and add to chunks
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [sentence]
-            current_length = sentence_length
-        else:
-            current_chunk.append(sentence)
-            current_length += sentence_length
-    
-    # Add the last chunk if it exists
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-    
-    return chunks
+# Identify the user across reruns and restarts; the id lives in the page URL
+if "client" not in st.query_params:
+    st.query_params["client"] = uuid.uuid4().hex
+client_id = st.query_params["client"]
 
-def clean_scraped_text(text):
-    """Remove common footer content and privacy policy text."""
-    # First, try to find and remove the entire privacy settings block
-    import re
-    
-    # Pattern to match the entire privacy settings section
-    privacy_pattern = r"Privacy settings\s*Decide which cookies.*?(?:Change settings Read more Accept|Save)"
-    cleaned_text = re.sub(privacy_pattern, "", text, flags=re.DOTALL)
-    
-    # Additional patterns to clean up
-    patterns = [
-        r"FunctionalityAnalyticsAdvertising",
-        r"(?:Essential|Functionality|Analytics|Advertising):.*?(?:\n|$)",
-        r"This page will(?: not)? be:.*?(?=This page|Save|\n\n|$)",
-        r"a contact forms, newsletter and other forms across all pages",
-        r"and interaction taken",
-        r"and region based on your IP number",
-        r"on each page",
-        r"of the statistics functions",
-        r"and advertising to your interests.*?targeting cookies\.\)",
-        r"we sometimes place small data files called cookies.*?websites do this too\.",
-        r"Change settings Read more Accept",
-        r"Save",
-        # Remove any remaining cookie-related text
-        r"Cookies To make this site work properly.*?(?:\n|$)",
-        # Remove multiple consecutive newlines and whitespace
-        r"\n\s*\n\s*\n+",
-    ]
-    
-    # Apply all patterns
-    for pattern in patterns:
-        cleaned_text = re.sub(pattern, "", cleaned_text, flags=re.DOTALL | re.MULTILINE)
-    
-    # Final cleanup of whitespace and newlines
-    cleaned_text = re.sub(r'\n\s*\n', '\n\n', cleaned_text)
-    cleaned_text = re.sub(r'^\s+|\s+$', '', cleaned_text, flags=re.MULTILINE)
-    
-    return cleaned_text.strip()
+# Jobs are run by ingestion_service.py; the app only submits and polls them
+@st.cache_resource
+def init_job_queue():
+    return JobQueue()
 
-def process_document(doc):
-    """Process a document by cleaning and splitting if necessary."""
-    cleaned_text = clean_scraped_text(doc.text)
-    text_chunks = split_text_into_chunks(cleaned_text)
-    
-    processed_docs = []
-    total_chunks = len(text_chunks)
-    
-    for i, chunk in enumerate(text_chunks, 1):
-        # Create new metadata with chunk information
-        chunk_metadata = doc.metadata.copy() if doc.metadata else {}
-        chunk_metadata.update({
-            'chunk_number': i,
-            'total_chunks': total_chunks,
-            'is_chunked': total_chunks > 1
-        })
-        
-        # Create new document with chunk
-        chunk_doc = Document(
-            text=chunk,
-            metadata=chunk_metadata,
-            id_=f"{doc.id_}_chunk_{i}" if doc.id_ else None
-        )
-        processed_docs.append(chunk_doc)
-    
-    return processed_docs
+job_queue = init_job_queue()
+
+# A finished job's documents never change, so parse them once per job
+@st.cache_data(max_entries=10)
+def load_job_documents(job_id):
+    return job_queue.load_documents(job_id)
 
-# Initialize session state for documents
-if 'documents' not in st.session_state:
-    st.session_state.documents = None
+# Initialize session state for the scrape job whose documents are shown and indexed
+if 'scrape_job_id' not in st.session_state:
+    st.session_state.scrape_job_id = None
 
 # Add Pinecone API key input
 pinecone_api_key = st.text_input(
@@ -121,64 +44,42 @@ pinecone_api_key = st.text_input(
     help="Enter your Pinecone API key to connect to your Pinecone instance"
 )
 
-# Initialize FireCrawl reader
-@st.cache_resource
-def init_firecrawl():
-    return FireCrawlWebReader(
-        api_key=st.secrets["firecrawl_api_key"],
-        mode="scrape"
-    )
-
-firecrawl_reader = init_firecrawl()
-
 # URL input section
 st.subheader("Enter URLs to Scrape")
 url_input = st.text_area("Enter URLs (one per line)", height=100)
 urls_to_scrape = [url.strip() for url in url_input.split("\n") if url.strip()]
+sitemap_url = st.text_input(
+    "Sitemap URL (optional)",
+    placeholder="e.g., https://example.com/sitemap.xml",
+    help="All pages listed in the sitemap are added to the URLs above, using the sitemap priorities."
+)
+max_sitemap_urls = st.number_input(
+    "Maximum pages from the sitemap",
+    min_value=1,
+    max_value=10000,
+    value=MAX_SITEMAP_URLS,
+    help="Every page is a paid scrape. The sitemap stops being read once this many pages are queued."
+)
 
 # Separate buttons for scraping and indexing
 col1, col2 = st.columns(2)
 
 with col1:
     if st.button("Scrape Content"):
-        if urls_to_scrape:
-            with st.spinner("Scraping content from URLs..."):
-                try:
-                    # Use FireCrawl to scrape the URLs
-                    documents = firecrawl_reader.load_data(urls=urls_to_scrape)
-                    
-                    # Process documents (clean and chunk if necessary)
-                    processed_documents = []
-                    for doc in documents:
-                        processed_docs = process_document(doc)
-                        processed_documents.extend(processed_docs)
-                    
-                    st.session_state.documents = processed_documents
-                    
-                    # Display results
-                    st.subheader("Scraped Content")
-                    current_url = None
-                    for doc in st.session_state.documents:
-                        url = doc.metadata.get('url', 'Unknown')
-                        if url != current_url:
-                            current_url = url
-                            st.markdown(f"### Content from: {url}")
-                        
-                        chunk_info = ""
-                        if doc.metadata.get('is_chunked', False):
-                            chunk_info = f" (Part {doc.metadata['chunk_number']}/{doc.metadata['total_chunks']})"
-                        
-                        with st.expander(f"Content{chunk_info}"):
-                            st.markdown("**Timestamp:** " + doc.metadata.get('timestamp', 'N/A'))
-                            if doc.metadata.get('is_chunked', False):
-                                st.markdown(f"**Chunk:** {doc.metadata['chunk_number']}/{doc.metadata['total_chunks']}")
-                            st.markdown("**Content:**")
-                            st.markdown(doc.text)
-                    
-                    st.success("Content successfully scraped!")
-                        
-                except Exception as e:
-                    st.error(f"An error occurred while scraping: {str(e)}")
+        if sitemap_url and canonicalize_url(sitemap_url) is None:
+            st.error("The sitemap URL must be a http(s) URL.")
+        elif urls_to_scrape or sitemap_url:
+            # URLs are canonicalized, deduplicated and ordered by the worker
+            st.session_state.scrape_job_id = job_queue.submit(
+                client_id,
+                "scrape",
+                {
+                    "urls": urls_to_scrape,
+                    "sitemap_url": sitemap_url or None,
+                    "max_sitemap_urls": int(max_sitemap_urls),
+                },
+            )
+            st.success("Scrape job submitted. You can follow its progress below.")
         else:
             st.warning("Please select URLs to scrape.")
 
@@ -197,7 +98,8 @@ with col2:
         st.info(f"Content will be indexed in: **{ime_indeksa}**")
     
     if st.button("Index in Pinecone"):
-        if st.session_state.documents:
+        scrape_job = job_queue.get(st.session_state.scrape_job_id) if st.session_state.scrape_job_id else None
+        if scrape_job and scrape_job["status"] == DONE:
             if not ime_indeksa:
                 st.error("Please enter an index name above.")
                 st.stop()
@@ -206,32 +108,109 @@ with col2:
                 st.error("Please enter your Pinecone API key above.")
                 st.stop()
                 
-            with st.spinner("Storing content in Pinecone..."):
-                try:
-                    # Initialize Pinecone and embedding model
-                    embed_model = VoyageEmbedding(
-                        voyage_api_key=st.secrets["voyage_api_key"],
-                        model_name="voyage-3-large",
-                    )
-
-                    pc = pi.Pinecone(api_key=pinecone_api_key)
-                    
-                    pinecone_index = pc.Index(ime_indeksa)
-
-                    vector_store = PineconeVectorStore(pinecone_index=pinecone_index, namespace='info')
-                    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-                    
-                    index = VectorStoreIndex.from_documents(
-                        st.session_state.documents,
-                        storage_context=storage_context,
-                        embed_model=embed_model
-                    )
-                    st.success("Content successfully indexed in Pinecone!")
-                except Exception as e:
-                    st.error(f"An error occurred while indexing: {str(e)}")
+            job_queue.submit(
+                client_id,
+                "index",
+                {
+                    "scrape_job_id": scrape_job["id"],
+                    "index_name": ime_indeksa,
+                },
+                # Encrypted in the queue and deleted when the job ends
+                secrets={"pinecone_api_key": pinecone_api_key},
+            )
+            st.success("Index job submitted. You can follow its progress below.")
         else:
             st.warning("Please scrape content first before indexing.")
 
+# Job status section, polled on its own so the rest of the page isn't rerun
+POLL_INTERVAL = 2
+# Stop polling queued jobs nobody picked up in this many seconds (service down)
+POLL_TIMEOUT = 300
+
+def is_stalled(job):
+    # The service renews the lease of running jobs; a stale lease means it died
+    return job["status"] == RUNNING and time.time() - (job["heartbeat_at"] or 0) > LEASE_TIMEOUT
+
+def active_job_ids(jobs):
+    return {job["id"] for job in jobs if job["status"] in (QUEUED, RUNNING)}
+
+def should_poll(jobs):
+    # Running jobs with a live lease will progress; queued ones may wait forever
+    now = datetime.datetime.now()
+    for job in jobs:
+        if job["status"] == RUNNING and not is_stalled(job):
+            return True
+        if job["status"] == QUEUED:
+            waiting = now - datetime.datetime.fromisoformat(job["updated_at"])
+            if waiting.total_seconds() < POLL_TIMEOUT:
+                return True
+    return False
+
+jobs = job_queue.list_jobs(client_id)
+st.session_state.active_job_ids = active_job_ids(jobs)
+polling = should_poll(jobs)
+
+@st.fragment(run_every=POLL_INTERVAL if polling else None)
+def show_jobs():
+    jobs = job_queue.list_jobs(client_id)
+    # A job started or finished: rerun the whole page to update content and polling
+    if active_job_ids(jobs) != st.session_state.active_job_ids or should_poll(jobs) != polling:
+        st.rerun()
+
+    if not jobs:
+        return
+
+    st.subheader("Jobs")
+    for job in jobs:
+        if job["kind"] == "scrape":
+            label = f"Scrape ({len(job['payload'].get('urls', []))} URL(s)"
+            label += ", sitemap)" if job["payload"].get("sitemap_url") else ")"
+        else:
+            label = f"Index into {job['payload'].get('index_name')}"
+        st.markdown(f"**{label}** – {job['status']} – {job['created_at'][:19].replace('T', ' ')}")
+
+        if job["status"] in (QUEUED, RUNNING):
+            st.progress(job["progress"], text=job["message"])
+        elif job["status"] == FAILED:
+            st.error(f"An error occurred: {job['error']}")
+        elif job["kind"] == "scrape":
+            if st.button("Show content", key=f"show_{job['id']}"):
+                st.session_state.scrape_job_id = job["id"]
+                st.rerun()
+
+    if any(job["status"] == QUEUED for job in jobs) and not any(job["status"] == RUNNING for job in jobs):
+        st.caption("Waiting for a worker. Make sure `python ingestion_service.py` is running.")
+    if any(is_stalled(job) for job in jobs):
+        st.caption("A worker stopped responding. Its jobs are retried once an ingestion service is running.")
+    if active_job_ids(jobs) and not polling:
+        st.caption("Stopped checking for updates.")
+        st.button("Refresh status")
+
+show_jobs()
+
+# Display results of the selected scrape job
+scrape_job = job_queue.get(st.session_state.scrape_job_id) if st.session_state.scrape_job_id else None
+if scrape_job and scrape_job["status"] == DONE:
+    st.subheader("Scraped Content")
+    st.info(scrape_job["message"])
+    current_url = None
+    for doc in load_job_documents(scrape_job["id"]):
+        url = doc.metadata.get('url', 'Unknown')
+        if url != current_url:
+            current_url = url
+            st.markdown(f"### Content from: {url}")
+        
+        chunk_info = ""
+        if doc.metadata.get('is_chunked', False):
+            chunk_info = f" (Part {doc.metadata['chunk_number']}/{doc.metadata['total_chunks']})"
+        
+        with st.expander(f"Content{chunk_info}"):
+            st.markdown("**Timestamp:** " + doc.metadata.get('timestamp', 'N/A'))
+            if doc.metadata.get('is_chunked', False):
+                st.markdown(f"**Chunk:** {doc.metadata['chunk_number']}/{doc.metadata['total_chunks']}")
+            st.markdown("**Content:**")
+            st.markdown(doc.text)
+
 # Remove the index name input from sidebar
 with st.sidebar:
     st.markdown("""
@@ -240,10 +219,13 @@ with st.sidebar:
     
     ### Process
     1. Provide Pinecone API key
-    2. Provide URLs to scrape
-    3. Click "Scrape Content" to fetch the content
-    4. Review the scraped content
-    5. Click "Index in Pinecone" to store in the database
+    2. Provide URLs to scrape (and optionally a sitemap)
+    3. Click "Scrape Content" to submit a scrape job
+    4. Once the job is done, review the scraped content
+    5. Click "Index in Pinecone" to submit an index job
+
+    Jobs run in the background (`python ingestion_service.py`), so they keep
+    going if this page is refreshed or closed.
     """)
 
 #TEMPLATE DOKUMENTA
@@ -0,0 +1,504 @@
+"""URL frontier: canonicalization, dedup and prioritized batching before scraping."""
+import gzip
+import hashlib
+import heapq
+import io
+import ipaddress
+import itertools
+import math
+import socket
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+# Query parameters that only track the visitor and never change page content
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "gbraid",
+    "wbraid",
+    "msclkid",
+    "yclid",
+    "mc_cid",
+    "mc_eid",
+    "igshid",
+    "_ga",
+    "_gl",
+    "_hsenc",
+    "_hsmi",
+    "ref_src",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Priority of sitemap entries without <priority>, as in the sitemap protocol
+SITEMAP_DEFAULT_PRIORITY = 0.5
+# Upper bound on the pages taken from one sitemap, every page is a paid scrape
+MAX_SITEMAP_URLS = 100
+# Upper bound on the sitemap files fetched for one sitemap index
+MAX_SITEMAP_FETCHES = 50
+# Largest sitemap accepted (after decompression), as in the sitemap protocol
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+
+
+def canonicalize_url(url: str) -> Optional[str]:
+    """Normalize a URL so that equivalent spellings compare equal.
+
+    Lowercases scheme and host, drops default ports, fragments, tracking
+    query parameters and trailing slashes, and sorts the remaining query.
+
+    Args:
+        url: The raw URL as typed by the user or found in a sitemap.
+
+    Returns:
+        Optional[str]: The canonical URL, or None if it is not a http(s) URL.
+    """
+    url = url.strip()
+    if not url:
+        return None
+    if "://" not in url:
+        url = "https://" + url
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+
+    host = parts.hostname.lower().rstrip(".")
+    if ":" in host:
+        # IPv6 literal, urlsplit strips its brackets
+        host = f"[{host}]"
+    if port and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    # Collapse duplicate slashes and drop the trailing one (except for the root)
+    path = "/".join(segment for segment in parts.path.split("/") if segment)
+    path = "/" + path
+
+    # Filter and sort the raw "key=value" pieces rather than re-encoding them,
+    # so a bare flag like "?preview" keeps its meaning
+    query = []
+    for piece in parts.query.split("&"):
+        if not piece:
+            continue
+        key = unquote_plus(piece.split("=", 1)[0]).lower()
+        if key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES):
+            continue
+        query.append(piece)
+    query.sort()
+
+    return urlunsplit((scheme, host, path, "&".join(query), ""))
+
+
+def url_domain(url: str) -> str:
+    """Return the host part of a canonical URL."""
+    return urlsplit(url).netloc
+
+
+def depth_priority(url: str) -> float:
+    """Default priority: shallower pages (fewer path segments) come first.
+
+    Uses the 0.0-1.0 scale of sitemap `<priority>`: the root is 1.0, one
+    level deep 0.5, two levels 0.33 and so on.
+    """
+    path = urlsplit(url).path
+    return 1.0 / (1 + len([segment for segment in path.split("/") if segment]))
+
+
+def clamp_priority(priority: Optional[float]) -> float:
+    """Bring a priority into 0.0-1.0; missing or non-finite values get 0.5."""
+    if priority is None or not math.isfinite(priority):
+        return SITEMAP_DEFAULT_PRIORITY
+    return min(max(priority, 0.0), 1.0)
+
+
+def is_public_url(url: str) -> bool:
+    """Check that every address the URL's host resolves to is public.
+
+    Keeps the server from fetching localhost, private networks or cloud
+    metadata endpoints on behalf of a user. The check resolves the name
+    separately from the fetch, so it does not stop DNS rebinding.
+    """
+    host = urlsplit(url).hostname
+    if not host:
+        return False
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except (socket.gaierror, UnicodeError):
+        return False
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            return False
+    return True
+
+
+class _PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Only follow redirects to public http(s) URLs."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if canonicalize_url(newurl) is None or not is_public_url(newurl):
+            raise urllib.error.URLError(f"refusing redirect to {newurl}")
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def _local_name(tag) -> str:
+    # Sitemaps are matched by local tag name, with or without the namespace
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _child_text(element: ET.Element, name: str) -> Optional[str]:
+    for child in element:
+        if _local_name(child.tag) == name:
+            return (child.text or "").strip()
+    return None
+
+
+def fetch_sitemap(url: str, timeout: float = 30.0) -> ET.Element:
+    """Download and parse a (possibly gzipped) sitemap.
+
+    Raises:
+        ValueError: If the URL is not public or the sitemap is too large.
+        OSError: If the download fails.
+        ET.ParseError: If the sitemap is not valid XML.
+    """
+    if not is_public_url(url):
+        raise ValueError("host is not a public address")
+
+    opener = urllib.request.build_opener(_PublicRedirectHandler)
+    with opener.open(url, timeout=timeout) as response:
+        data = response.read(MAX_SITEMAP_BYTES + 1)
+
+    if data[:2] == b"\x1f\x8b":
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+            data = f.read(MAX_SITEMAP_BYTES + 1)
+    if len(data) > MAX_SITEMAP_BYTES:
+        raise ValueError("sitemap is larger than 50 MB")
+
+    return ET.fromstring(data)
+
+
+class BloomFilter:
+    """Compact probabilistic seen-set.
+
+    Never reports a seen URL as new; may (rarely) report a new URL as seen,
+    with a probability close to `error_rate` while below `capacity` items.
+
+    Args:
+    capacity: Expected number of distinct items.
+    error_rate: Target false positive rate.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001) -> None:
+        """Initialize with parameters."""
+        if capacity <= 0:
+            raise ValueError("capacity must be positive.")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1.")
+
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str) -> bool:
+        """Add an item.
+
+        Returns:
+            bool: True if the item was not (probably) present before.
+        """
+        added = False
+        for pos in self._positions(item):
+            byte, bit = divmod(pos, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        if added:
+            self._count += 1
+        return added
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[pos // 8] & (1 << (pos % 8)) for pos in self._positions(item)
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class URLFrontier:
+    """Queue of URLs waiting to be scraped.
+
+    URLs are canonicalized and deduplicated on the way in. Each domain has
+    its own queue; on the way out the domain whose next URL has the highest
+    priority goes first, and domains with equal priority take turns.
+
+    Politeness: a batch takes at most `max_per_domain` URLs from a domain,
+    and a domain used in a batch is not used again for `min_domain_interval`
+    seconds. `batches` waits for that interval when only such domains are left.
+
+    Priorities use the 0.0-1.0 scale of sitemap `<priority>`. URLs added
+    without one (typed URLs) get `priority_fn`, by default `depth_priority`;
+    sitemap entries without one get 0.5. So a typed site root (1.0) comes
+    before any sitemap page below priority 1.0, and a typed page one level
+    deep ties with an unprioritized sitemap page. On a tie the URL added
+    first goes first.
+
+    Args:
+    capacity: Expected number of distinct URLs, sizes the Bloom filter.
+    error_rate: False positive rate of the Bloom filter.
+    priority_fn: Maps a canonical URL to a priority (higher goes first).
+    Defaults to `depth_priority`.
+    max_per_domain: Maximum URLs from one domain in a single batch.
+    min_domain_interval: Minimum seconds between two batches using the same domain.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1_000_000,
+        error_rate: float = 0.001,
+        priority_fn: Optional[Callable[[str], float]] = None,
+        max_per_domain: Optional[int] = None,
+        min_domain_interval: float = 0.0,
+    ) -> None:
+        """Initialize with parameters."""
+        self.seen = BloomFilter(capacity=capacity, error_rate=error_rate)
+        self.priority_fn = priority_fn or depth_priority
+        self.max_per_domain = max_per_domain
+        self.min_domain_interval = min_domain_interval
+        self.duplicates = 0
+        self.rejected: List[str] = []
+        self.failed_sitemaps: List[str] = []
+
+        self._counter = itertools.count()
+        self._size = 0
+        # Per-domain heaps of (-priority, seq, url)
+        self._queues: Dict[str, List[tuple]] = {}
+        # Domains ready to be served: (-head priority, times served, seq, domain)
+        self._ready: List[tuple] = []
+        # Domains waiting for their interval: (allowed at, seq, domain)
+        self._waiting: List[tuple] = []
+        # Each domain has at most one live entry in _ready/_waiting, the one
+        # with this seq; older entries are skipped when popped
+        self._entry: Dict[str, int] = {}
+        self._served: Dict[str, int] = {}
+        self._allowed_at: Dict[str, float] = {}
+
+    def _schedule(self, domain: str, now: float) -> None:
+        """(Re)place a domain in the ready or waiting heap."""
+        queue = self._queues.get(domain)
+        if not queue:
+            self._entry.pop(domain, None)
+            self._queues.pop(domain, None)
+            return
+
+        seq = next(self._counter)
+        self._entry[domain] = seq
+        allowed_at = self._allowed_at.get(domain, 0.0)
+        if allowed_at > now:
+            heapq.heappush(self._waiting, (allowed_at, seq, domain))
+        else:
+            heapq.heappush(self._ready, (queue[0][0], self._served.get(domain, 0), seq, domain))
+
+    def _release_waiting(self, now: float) -> None:
+        while self._waiting and self._waiting[0][0] <= now:
+            _, seq, domain = heapq.heappop(self._waiting)
+            if self._entry.get(domain) == seq:
+                self._schedule(domain, now)
+
+    def add(self, url: str, priority: Optional[float] = None) -> bool:
+        """Add a URL to the frontier.
+
+        Args:
+            url: Raw URL.
+            priority: Explicit priority, overrides `priority_fn`. Clamped to
+                0.0-1.0; non-finite values get 0.5.
+
+        Returns:
+            bool: True if the URL was queued, False if invalid or already seen.
+        """
+        canonical = canonicalize_url(url)
+        if canonical is None:
+            self.rejected.append(url)
+            return False
+        if not self.seen.add(canonical):
+            self.duplicates += 1
+            return False
+
+        if priority is None:
+            priority = self.priority_fn(canonical)
+        priority = clamp_priority(priority)
+
+        domain = url_domain(canonical)
+        queue = self._queues.setdefault(domain, [])
+        head = queue[0][0] if queue else None
+        heapq.heappush(queue, (-priority, next(self._counter), canonical))
+        self._size += 1
+
+        # Reschedule a new domain, or a ready one whose best priority changed
+        if head is None or (queue[0][0] != head and self._allowed_at.get(domain, 0.0) <= time.monotonic()):
+            self._schedule(domain, time.monotonic())
+        return True
+
+    def add_many(self, urls: Iterable[str], priority: Optional[float] = None) -> int:
+        """Add several URLs. Returns the number actually queued."""
+        return sum(self.add(url, priority=priority) for url in urls)
+
+    def seed_from_sitemap(
+        self,
+        sitemap_url: str,
+        max_urls: Optional[int] = MAX_SITEMAP_URLS,
+        max_fetches: int = MAX_SITEMAP_FETCHES,
+        timeout: float = 30.0,
+    ) -> int:
+        """Queue the URLs listed in a sitemap (or sitemap index).
+
+        `<priority>` entries of the sitemap are used as URL priorities,
+        entries without one get `SITEMAP_DEFAULT_PRIORITY`. Only public
+        http(s) sitemaps are fetched. Sitemaps that can't be fetched or
+        parsed are skipped and listed in `failed_sitemaps`.
+
+        Args:
+            sitemap_url: URL of sitemap.xml.
+            max_urls: Stop after queueing this many URLs, None for no limit.
+            max_fetches: Maximum number of sitemap files downloaded.
+            timeout: Timeout in seconds for each sitemap request.
+
+        Returns:
+            int: Number of URLs queued.
+        """
+        root_url = canonicalize_url(sitemap_url)
+        if root_url is None:
+            self.failed_sitemaps.append(f"{sitemap_url} (not a http(s) URL)")
+            return 0
+
+        queued = 0
+        fetches = 0
+        pending = [root_url]
+        visited = set()
+
+        while pending:
+            current = pending.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+
+            if fetches >= max_fetches:
+                self.failed_sitemaps.append(
+                    f"{len(pending) + 1} sitemap(s) skipped after {max_fetches} fetches"
+                )
+                break
+            fetches += 1
+
+            try:
+                root = fetch_sitemap(current, timeout=timeout)
+            except (OSError, ValueError, EOFError, zlib.error, ET.ParseError) as e:
+                self.failed_sitemaps.append(f"{current} ({e})")
+                continue
+
+            if _local_name(root.tag) == "sitemapindex":
+                for entry in root:
+                    if _local_name(entry.tag) != "sitemap":
+                        continue
+                    # Child sitemaps come from the remote site, never fetch non-http(s) ones
+                    child_url = canonicalize_url(_child_text(entry, "loc") or "")
+                    if child_url is not None:
+                        pending.append(child_url)
+                continue
+
+            for entry in root:
+                if _local_name(entry.tag) != "url":
+                    continue
+                loc = _child_text(entry, "loc")
+                if not loc:
+                    continue
+                try:
+                    priority = float(_child_text(entry, "priority") or SITEMAP_DEFAULT_PRIORITY)
+                except ValueError:
+                    priority = SITEMAP_DEFAULT_PRIORITY
+                if self.add(loc, priority=priority):
+                    queued += 1
+                    if max_urls is not None and queued >= max_urls:
+                        return queued
+
+        return queued
+
+    def next_batch(self, batch_size: int) -> List[str]:
+        """Pop up to `batch_size` URLs in priority and politeness order.
+
+        Returns fewer URLs (possibly none) when the remaining domains are
+        waiting for `min_domain_interval`; see `wait_time`.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+
+        now = time.monotonic()
+        self._release_waiting(now)
+
+        batch = []
+        taken: Dict[str, int] = {}
+
+        while self._ready and len(batch) < batch_size:
+            _, _, seq, domain = heapq.heappop(self._ready)
+            if self._entry.get(domain) != seq:
+                continue
+            del self._entry[domain]
+
+            _, _, url = heapq.heappop(self._queues[domain])
+            batch.append(url)
+            self._size -= 1
+            self._served[domain] = self._served.get(domain, 0) + 1
+            taken[domain] = taken.get(domain, 0) + 1
+
+            if self.max_per_domain is None or taken[domain] < self.max_per_domain:
+                self._schedule(domain, now)
+
+        # Domains used in this batch rest before the next one
+        for domain in taken:
+            if self.min_domain_interval > 0:
+                self._allowed_at[domain] = now + self.min_domain_interval
+            self._schedule(domain, now)
+
+        return batch
+
+    def wait_time(self) -> float:
+        """Seconds until the next waiting domain may be used again."""
+        while self._waiting and self._entry.get(self._waiting[0][2]) != self._waiting[0][1]:
+            heapq.heappop(self._waiting)
+        if self._ready or not self._waiting:
+            return 0.0
+        return max(0.0, self._waiting[0][0] - time.monotonic())
+
+    def batches(self, batch_size: int) -> Iterator[List[str]]:
+        """Drain the frontier in batches, waiting out the domain interval."""
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+
+        while self._size:
+            batch = self.next_batch(batch_size)
+            if batch:
+                yield batch
+            else:
+                time.sleep(self.wait_time())
+
+    def __len__(self) -> int:
+        return self._size